@@ -3,6 +3,9 @@ import time
 import random
 import json
 import re
+import struct
+from array import array
+from bisect import bisect_left, insort
 from pathlib import Path
 import requests
 from bs4 import BeautifulSoup, Comment
@@ -14,6 +17,13 @@ OUTPUT_DIR = Path("drom_corpus")
 TARGET_COUNT = 80123 
 REQUEST_TIMEOUT = 10
 DELAY = (0.5, 1.2)
+CHECKPOINT_EVERY = 100
+
+# magic, версия, последняя обработанная страница, собрано документов,
+# длина metadata.jsonl на момент записи, число id
+CHECKPOINT_HEADER = struct.Struct("<4sIIIQI")
+CHECKPOINT_MAGIC = b"DRCP"
+CHECKPOINT_VERSION = 1
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
@@ -41,6 +51,51 @@ def extract_content(html):
     text = re.sub(r'\s+', ' ', text)
     return text
 
+def url_doc_id(url):
+    m = re.search(r'(\d+)\.html$', url)
+    return int(m.group(1)) if m else None
+
+def is_seen(ids, doc_id):
+    if doc_id is None:
+        return False
+    i = bisect_left(ids, doc_id)
+    return i < len(ids) and ids[i] == doc_id
+
+def mark_seen(ids, doc_id):
+    if doc_id is not None and not is_seen(ids, doc_id):
+        insort(ids, doc_id)
+
+def read_metadata(meta_file, ids, offset=0):
+    count = 0
+    with open(meta_file, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            data = json.loads(line)
+            mark_seen(ids, url_doc_id(data['url']))
+            count += 1
+            offset += len(line)
+    return count, offset
+
+def load_checkpoint(path):
+    with open(path, "rb") as f:
+        header = f.read(CHECKPOINT_HEADER.size)
+        magic, version, last_page, collected, meta_offset, n_ids = CHECKPOINT_HEADER.unpack(header)
+        if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+            raise ValueError(f"Неизвестный формат чекпоинта {path}")
+        ids = array("I")
+        ids.fromfile(f, n_ids)
+    return last_page, collected, meta_offset, ids
+
+def save_checkpoint(path, last_page, collected, meta_offset, ids):
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION,
+                                       last_page, collected, meta_offset, len(ids)))
+        ids.tofile(f)
+    os.replace(tmp_path, path)
+
 def get_article_links(page_num, session):
     url = PAGINATION_URL.format(page_num)
     try:
@@ -62,22 +117,31 @@ def get_article_links(page_num, session):
 def main():
     ensure_dirs()
     meta_file = OUTPUT_DIR / "meta" / "metadata.jsonl"
+    checkpoint_file = OUTPUT_DIR / "meta" / "checkpoint.bin"
     
     collected_count = 0
-    seen_urls = set()
+    last_page = 0
+    meta_offset = 0
+    seen_ids = array("I")
+
+    if checkpoint_file.exists():
+        try:
+            last_page, collected_count, meta_offset, seen_ids = load_checkpoint(checkpoint_file)
+        except (OSError, ValueError, struct.error, EOFError) as e:
+            print(f"Чекпоинт поврежден, читаю метаданные заново: {e}")
+            collected_count, last_page, meta_offset, seen_ids = 0, 0, 0, array("I")
 
     if meta_file.exists():
-        with open(meta_file, "r", encoding="utf-8") as f:
-            for line in f:
-                data = json.loads(line)
-                seen_urls.add(data['url'])
-                collected_count += 1
+        # После чекпоинта дочитываем только хвост metadata.jsonl
+        tail_count, meta_offset = read_metadata(meta_file, seen_ids, meta_offset)
+        collected_count += tail_count
 
     session = requests.Session()
     pbar = tqdm(total=TARGET_COUNT, desc="Collecting Drom News")
     pbar.update(collected_count)
 
-    page = 1
+    page = last_page + 1
+    since_checkpoint = 0
     while collected_count < TARGET_COUNT:
         links = get_article_links(page, session)
         if not links:
@@ -85,7 +149,7 @@ def main():
             break
 
         for url in links:
-            if url in seen_urls:
+            if is_seen(seen_ids, url_doc_id(url)):
                 continue
             if collected_count >= TARGET_COUNT:
                 break
@@ -118,15 +182,24 @@ def main():
                     
                     with open(meta_file, "a", encoding="utf-8") as f:
                         f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+                        meta_offset = f.tell()
                     
-                    seen_urls.add(url)
+                    mark_seen(seen_ids, url_doc_id(url))
                     collected_count += 1
                     pbar.update(1)
+
+                    since_checkpoint += 1
+                    if since_checkpoint >= CHECKPOINT_EVERY:
+                        save_checkpoint(checkpoint_file, page - 1, collected_count, meta_offset, seen_ids)
+                        since_checkpoint = 0
             except Exception as e:
                 print(f"Failed to download {url}: {e}")
 
+        save_checkpoint(checkpoint_file, page, collected_count, meta_offset, seen_ids)
+        since_checkpoint = 0
         page += 1
 
+    save_checkpoint(checkpoint_file, page - 1, collected_count, meta_offset, seen_ids)
     pbar.close()
     print(f"Сбор завершен! Итого документов: {collected_count}")
 
@@ -1,7 +1,10 @@
 import argparse
 import hashlib
+import heapq
+import itertools
 import json
 import logging
+import math
 import random
 import re
 import signal
@@ -12,7 +15,8 @@ from urllib.parse import urljoin, urlsplit, urlunsplit
 import requests
 import yaml
 from bs4 import BeautifulSoup
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import MongoClient, ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 
 logging.basicConfig(
     format="%(asctime)s [%(levelname)s] ROBOT: %(message)s",
@@ -59,6 +63,88 @@ def get_links(html: str, parent_url: str):
         yield urljoin(parent_url, href)
 
 
+# Очередь задач в памяти: куча по next_check для каждого хоста
+# и общая куча хостов по времени готовности к следующему запросу.
+# У каждого хоста в общей куче не больше одной актуальной записи:
+# queued[host] хранит ее версию, записи с другой версией устарели.
+class Frontier:
+    def __init__(self, col_urls, prefetch_size, prefetch_horizon, refill_interval):
+        self.col_urls = col_urls
+        self.prefetch_size = prefetch_size
+        self.prefetch_horizon = prefetch_horizon
+        self.refill_interval = refill_interval
+        self.hosts = {}
+        self.ready = []
+        self.queued = {}
+        self.busy = set()
+        self.host_free_at = {}
+        self.loaded = set()
+        self.refill_at = 0
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self.loaded)
+
+    def _schedule_host(self, host):
+        version = next(self._seq)
+        self.queued[host] = version
+        ready_ts = max(self.hosts[host][0][0], self.host_free_at.get(host, 0))
+        heapq.heappush(self.ready, (ready_ts, version, host))
+
+    def push(self, task):
+        host = urlsplit(task['url']).netloc
+        queue = self.hosts.setdefault(host, [])
+        was_head = queue[0][0] if queue else None
+        heapq.heappush(queue, (task['next_check'], next(self._seq), task))
+        self.loaded.add(task['_id'])
+        if host in self.busy:
+            return
+        if host not in self.queued or task['next_check'] < was_head:
+            self._schedule_host(host)
+
+    def refill(self, now):
+        free = self.prefetch_size - len(self.loaded)
+        added = 0
+        if free > 0:
+            query = {'next_check': {'$lte': now + self.prefetch_horizon}}
+            if self.loaded:
+                query['_id'] = {'$nin': list(self.loaded)}
+            cursor = self.col_urls.find(query).sort('next_check', ASCENDING).limit(free)
+            for task in cursor:
+                self.push(task)
+                added += 1
+
+        self.refill_at = now + self.refill_interval
+        if not self.loaded:
+            nearest = self.col_urls.find_one({}, {'next_check': 1}, sort=[('next_check', ASCENDING)])
+            if nearest is not None:
+                self.refill_at = max(now, nearest['next_check'] - self.prefetch_horizon)
+        return added
+
+    def pop(self, now):
+        while self.ready:
+            ts, version, host = self.ready[0]
+            if self.queued.get(host) != version:
+                heapq.heappop(self.ready)
+                continue
+            if ts > now:
+                return None, ts
+            heapq.heappop(self.ready)
+            del self.queued[host]
+            self.busy.add(host)
+            task = heapq.heappop(self.hosts[host])[2]
+            return task, now
+        return None, None
+
+    def done(self, task, host_free_at):
+        host = urlsplit(task['url']).netloc
+        self.host_free_at[host] = host_free_at
+        self.loaded.discard(task['_id'])
+        self.busy.discard(host)
+        if self.hosts.get(host):
+            self._schedule_host(host)
+
+
 class MongoCrawler:
     def __init__(self, config_path: str):
         with open(config_path, 'r', encoding='utf-8') as f:
@@ -77,7 +163,14 @@ class MongoCrawler:
         self.http_timeout = logic.get('timeout', 10)
         self.retry_delay = logic.get('retry_delay', 3600)
         self.recrawl_period = logic.get('recrawl_period', 86400)
-        self.batch_size = logic.get('batch_size', 20)
+        self.min_recrawl_period = logic.get('min_recrawl_period', 3600)
+        self.max_recrawl_period = logic.get('max_recrawl_period', 30 * 86400)
+        self.history_size = logic.get('change_history_size', 20)
+        self.prefetch_size = logic.get('prefetch_size', 1000)
+        self.prefetch_horizon = logic.get('prefetch_horizon', 300)
+        self.refill_interval = logic.get('refill_interval', 60)
+        self.write_batch_size = logic.get('write_batch_size', 50)
+        self.pending_writes = []
         self.user_agent = logic.get('user_agent', 'Bot/2.0')
         
         d_range = logic.get('delay', [1.0, 2.0])
@@ -132,9 +225,10 @@ class MongoCrawler:
                         'status': 'new',
                         'content_hash': None,
                         'etag': None,
-                        'last_mod': None
-                    },
-                    '$min': {'next_check': priority_ts}
+                        'last_mod': None,
+                        # Для известных URL next_check задает только _recrawl_update
+                        'next_check': priority_ts
+                    }
                 },
                 upsert=True
             )
@@ -184,6 +278,109 @@ class MongoCrawler:
             log.warning(f"Сбой сети для {url}: {e}")
             return None
 
+    def _update_url(self, task, update):
+        self.pending_writes.append(UpdateOne({'_id': task['_id']}, update))
+        if len(self.pending_writes) >= self.write_batch_size:
+            self.flush_writes()
+
+    def flush_writes(self):
+        # Возвращает False, если статусы не записаны: они остаются в очереди
+        # и отправляются повторно при следующем сбросе
+        if not self.pending_writes:
+            return True
+        ops, self.pending_writes = self.pending_writes, []
+        try:
+            self.col_urls.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            log.error(f"Ошибка Mongo при записи статусов: {e.details.get('writeErrors')}")
+        except PyMongoError as e:
+            log.error(f"Ошибка Mongo при записи {len(ops)} статусов, повтор позже: {e}")
+            self.pending_writes = ops + self.pending_writes
+            return False
+        return True
+
+    def _estimate_change_rate(self, history):
+        # Оценка Чо и Гарсиа-Молины для пуассоновского процесса изменений:
+        # при n проверках с интервалом I и X обнаруженных изменениях
+        # lambda = -ln((n - X + 0.5) / (n + 0.5)) / I
+        n = len(history)
+        if n == 0:
+            return None
+        changes = sum(1 for h in history if h['changed'])
+        interval = sum(h['dt'] for h in history) / n
+        if interval <= 0:
+            return None
+        if changes == 0:
+            return 0.0
+        return -math.log((n - changes + 0.5) / (n + 0.5)) / interval
+
+    def _recrawl_update(self, task, changed, now):
+        history = list(task.get('change_history') or [])
+        last_check = task.get('last_check')
+        update = {'$set': {'last_check': now}, '$inc': {'checks': 1}, '$min': {'first_check': now}}
+
+        if last_check is not None and changed is not None:
+            entry = {'ts': now, 'dt': now - last_check, 'changed': changed}
+            history = (history + [entry])[-self.history_size:]
+            update['$push'] = {'change_history': {'$each': [entry], '$slice': -self.history_size}}
+            if changed:
+                update['$inc']['changes'] = 1
+
+        rate = self._estimate_change_rate(history)
+        prev_interval = task.get('recrawl_interval') or self.recrawl_period
+        if rate is None:
+            interval = prev_interval
+        elif rate == 0:
+            interval = 2 * prev_interval
+        else:
+            interval = min(1 / rate, 2 * prev_interval)
+        interval = int(max(self.min_recrawl_period, min(self.max_recrawl_period, interval)))
+
+        update['$set'].update({
+            'change_rate': rate,
+            'recrawl_interval': interval,
+            'next_check': now + interval
+        })
+        return update
+
+    def report(self):
+        now = int(time.time())
+        total = checks = fixed_checks = 0
+        freshness_sum = 0.0
+        observed = unchanged = 0
+        cursor = self.col_urls.find(
+            {'checks': {'$gt': 0}},
+            {'first_check': 1, 'checks': 1, 'change_rate': 1, 'recrawl_interval': 1, 'change_history': 1}
+        )
+        for rec in cursor:
+            total += 1
+            # checks считаются с первой проверки после включения адаптивного
+            # переобхода, поэтому и фиксированный период отсчитывается от нее
+            if 'first_check' in rec:
+                checks += rec['checks']
+                elapsed = max(0, now - rec['first_check'])
+                fixed_checks += elapsed // self.recrawl_period + 1
+
+            rate = rec.get('change_rate') or 0.0
+            interval = rec.get('recrawl_interval') or self.recrawl_period
+            x = rate * interval
+            freshness_sum += 1.0 if x == 0 else (1 - math.exp(-x)) / x
+
+            for h in rec.get('change_history') or []:
+                observed += 1
+                unchanged += not h['changed']
+
+        if not total:
+            log.info("Нет проверенных URL для отчета")
+            return
+        log.info(f"URL с проверками: {total}")
+        if fixed_checks:
+            log.info(f"Загрузок выполнено: {checks}, при фиксированном периоде было бы: {fixed_checks}")
+            log.info(f"Сэкономлено загрузок: {fixed_checks - checks} ({(fixed_checks - checks) / fixed_checks:.1%})")
+        log.info(f"Ожидаемая свежесть копий: {freshness_sum / total:.1%}")
+        if observed:
+            log.info(f"Проверок без изменений: {unchanged}/{observed} ({unchanged / observed:.1%})")
+
     def worker_step(self, task):
         url = task['url']
         source = task['source']
@@ -193,22 +390,14 @@ class MongoCrawler:
         now = int(time.time())
 
         if resp is None:
-            self.col_urls.update_one(
-                {'_id': task['_id']},
-                {'$set': {'next_check': now + self.retry_delay}}
-            )
+            self._update_url(task, {'$set': {'next_check': now + self.retry_delay}})
             return
 
         if resp.status_code == 304:
             log.info(f"Не изменился (304): {url}")
-            self.col_urls.update_one(
-                {'_id': task['_id']},
-                {'$set': {
-                    'next_check': now + self.recrawl_period,
-                    'last_check': now,
-                    'status': '304'
-                }}
-            )
+            update = self._recrawl_update(task, False, now)
+            update['$set']['status'] = '304'
+            self._update_url(task, update)
             return
 
         if resp.status_code == 200:
@@ -246,63 +435,73 @@ class MongoCrawler:
                         count += 1
                 if count: log.info(f"Найдено {count} ссылок")
 
-            self.col_urls.update_one(
-                {'_id': task['_id']},
-                {'$set': {
-                    'next_check': now + self.recrawl_period,
-                    'last_check': now,
-                    'status': '200',
-                    'content_hash': new_hash,
-                    'etag': resp.headers.get('ETag'),
-                    'last_mod': resp.headers.get('Last-Modified')
-                }}
-            )
+            update = self._recrawl_update(task, is_changed if old_hash else None, now)
+            update['$set'].update({
+                'status': '200',
+                'content_hash': new_hash,
+                'etag': resp.headers.get('ETag'),
+                'last_mod': resp.headers.get('Last-Modified')
+            })
+            self._update_url(task, update)
             return
 
         log.warning(f"Код ответа {resp.status_code}: {url}")
-        self.col_urls.update_one(
-            {'_id': task['_id']},
-            {'$set': {
-                'next_check': now + self.recrawl_period, 
-                'last_check': now,
-                'status': str(resp.status_code)
-            }}
-        )
+        update = self._recrawl_update(task, None, now)
+        update['$set']['status'] = str(resp.status_code)
+        self._update_url(task, update)
+
+    def _sleep_until(self, ts, killer):
+        while not killer.kill_now:
+            remaining = ts - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 1.0))
 
     def start(self):
         log.info("Запуск Crawler...")
         killer = GracefulKiller()
         
         self.load_seeds()
+        frontier = Frontier(self.col_urls, self.prefetch_size, self.prefetch_horizon, self.refill_interval)
         
-        while not killer.kill_now:
-            now = int(time.time())
-            cursor = self.col_urls.find(
-                {'next_check': {'$lte': now}}
-            ).sort('next_check', ASCENDING).limit(self.batch_size)
+        try:
+            while not killer.kill_now:
+                now = time.time()
+                if now >= frontier.refill_at:
+                    # Пока статусы не записаны, у их URL в Mongo старый next_check:
+                    # подгрузка вернула бы их в очередь и они были бы скачаны повторно
+                    if self.flush_writes():
+                        added = frontier.refill(now)
+                        if added:
+                            log.info(f"Загружено в очередь {added} задач (всего {len(frontier)})")
+                    else:
+                        frontier.refill_at = now + frontier.refill_interval
             
-            tasks = list(cursor)
+                task, wake_at = frontier.pop(now)
+                if task is None:
+                    wake_at = frontier.refill_at if wake_at is None else min(wake_at, frontier.refill_at)
+                    self.flush_writes()
+                    if wake_at - now > 5:
+                        log.info(f"Нет готовых задач. Сплю {wake_at - now:.0f} с...")
+                    self._sleep_until(wake_at, killer)
+                    continue
             
-            if not tasks:
-                log.info("Очередь пуста или задачи отложены. Сплю...")
-                time.sleep(5)
-                continue
-            
-            for task in tasks:
-                if killer.kill_now: break
                 self.worker_step(task)
-                
-                sleep_time = random.uniform(*self.delay_range)
-                time.sleep(sleep_time)
-        
+                frontier.done(task, time.time() + random.uniform(*self.delay_range))
+        finally:
+            self.flush_writes()
         log.info("Работа завершена.")
 
 def main():
     parser = argparse.ArgumentParser(description="Lab 2 Crawler")
     parser.add_argument('config', help='Путь к YAML конфигу')
+    parser.add_argument('--report', action='store_true', help='Отчет об адаптивном переобходе')
     args = parser.parse_args()
     
     bot = MongoCrawler(args.config)
+    if args.report:
+        bot.report()
+        return
     bot.start()
 
 if __name__ == '__main__':
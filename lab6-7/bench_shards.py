@@ -0,0 +1,60 @@
+import argparse
+import random
+import time
+
+from boolean_searcher import DICT_STRUCT, ShardedSearcher, shard_dirs
+from get_bin import build_sharded, shard_dir
+
+def sample_queries(index_root, count, seed=42):
+    terms = []
+    with open(shard_dir(index_root, 0) / "dictionary.bin", "rb") as f:
+        for term_b, freq, _, _, _ in DICT_STRUCT.iter_unpack(f.read()):
+            if freq > 1:
+                terms.append(term_b.decode('utf-8', errors='ignore').strip('\x00'))
+    rnd = random.Random(seed)
+    templates = ["{} {}", "{} OR {}", "{} AND NOT {}", "({} OR {}) AND {}"]
+    queries = []
+    for _ in range(count):
+        template = rnd.choice(templates)
+        queries.append(template.format(*rnd.sample(terms, template.count("{}"))))
+    return queries
+
+def run(index_root, num_shards, queries, ranked):
+    searcher = ShardedSearcher(shard_dirs(str(index_root), num_shards))
+    try:
+        for q in queries[:num_shards * 2]:
+            searcher.find(q, 50, ranked)
+        start = time.perf_counter()
+        for q in queries:
+            searcher.find(q, 50, ranked)
+        elapsed = time.perf_counter() - start
+    finally:
+        searcher.close()
+    return len(queries) / elapsed, elapsed / len(queries) * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пропускная способность поиска в зависимости от числа шардов")
+    parser.add_argument("--corpus", default="drom_corpus")
+    parser.add_argument("--out", default="bench_shards")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--ranked", action="store_true")
+    parser.add_argument("--skip-build", action="store_true")
+    args = parser.parse_args()
+
+    results = []
+    queries = None
+    for n in args.shards:
+        root = f"{args.out}/n{n}"
+        if not args.skip_build:
+            start = time.perf_counter()
+            build_sharded(args.corpus, n, root)
+            print(f"Построение {n} шардов: {time.perf_counter() - start:.1f} с")
+        if queries is None:
+            queries = sample_queries(root, args.queries)
+        results.append((n, *run(root, n, queries, args.ranked)))
+
+    print(f"{'шарды':>6} {'запр/с':>10} {'мс/запрос':>10} {'ускорение':>10}")
+    base = results[0][1]
+    for n, qps, latency in results:
+        print(f"{n:>6} {qps:>10.1f} {latency:>10.2f} {qps / base:>10.2f}")
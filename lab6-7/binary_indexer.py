@@ -4,6 +4,8 @@ import struct
 import re
 from pathlib import Path
 
+from postings import RoaringBitmap, encode_postings
+
 TERM_SIZE = 32      
 DOC_REC_SIZE = 512  
 
@@ -14,6 +16,8 @@ class BinaryIndexer:
         self.metadata_path = self.corpus_path / "meta" / "metadata.jsonl"
         self.inverted_index = {} 
         self.docs_meta = []
+        self.indexed_ids = set()
+        self.indexed_count = 0
 
     def tokenize(self, text):
         return re.findall(r'[a-zа-я0-9]+', text.lower())
@@ -56,10 +60,12 @@ class BinaryIndexer:
                         self.inverted_index[term] = []
                     self.inverted_index[term].append(doc_id)
             
+            self.indexed_ids.add(doc_id)
             indexed_count += 1
             if indexed_count % 2000 == 0:
                 print(f"Обработано {indexed_count} текстов...")
 
+        self.indexed_count = indexed_count
         self._write_docs_bin()
         self._write_postings_and_dict()
 
@@ -72,6 +78,11 @@ class BinaryIndexer:
                 data = struct.pack("<I128s380s", doc['id'], url, title)
                 f.write(data)
 
+        # В universe только документы с проиндексированным текстом
+        universe = sorted(self.indexed_ids)
+        with open("universe.bin", "wb") as f:
+            f.write(RoaringBitmap.from_sorted(universe).serialize())
+
     def _write_postings_and_dict(self):
         print("Запись dictionary.bin и postings.bin...")
         
@@ -83,14 +94,14 @@ class BinaryIndexer:
                 postings = sorted(list(set(self.inverted_index[term])))
                 freq = len(postings)
                 
-                post_data = struct.pack(f"<{freq}I", *postings)
+                kind, post_data = encode_postings(postings, self.indexed_count)
                 f_post.write(post_data)
                 
                 term_bytes = term.encode('utf-8')[:TERM_SIZE-1]
-                dict_entry = struct.pack(f"<{TERM_SIZE}sIQ", term_bytes, freq, offset)
+                dict_entry = struct.pack(f"<{TERM_SIZE}sIQIB", term_bytes, freq, offset, len(post_data), kind)
                 f_dict.write(dict_entry)
                 
-                offset += freq * 4 
+                offset += len(post_data)
 
 if __name__ == "__main__":
     indexer = BinaryIndexer("drom_corpus")
@@ -1,17 +1,78 @@
+import os
+import re
+import math
+import heapq
 import struct
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
 from flask import Flask, request, render_template_string
 
+from postings import RoaringBitmap, decode_postings, first_ids, p_and, p_andnot, p_or
+from snippets import SnippetStore
+
 app = Flask(__name__)
 
-DICT_STRUCT = struct.Struct("<32sIQ")
+DICT_STRUCT = struct.Struct("<32sIQIB")
 DOC_STRUCT = struct.Struct("<I128s124s")
 
+TOKEN_RE = re.compile(r'\(|\)|&&|\|\||!|[a-zа-я0-9]+')
+AND_OPS = {"and", "и", "&&"}
+OR_OPS = {"or", "или", "||"}
+NOT_OPS = {"not", "не", "!"}
+
+def query_terms(query, positive_only=False):
+    terms = []
+    negated_depth = None
+    depth = 0
+    prev = None
+    for token in TOKEN_RE.findall(query.lower()):
+        if token == "(":
+            depth += 1
+            if prev in NOT_OPS and negated_depth is None:
+                negated_depth = depth
+        elif token == ")":
+            if depth == negated_depth:
+                negated_depth = None
+            depth -= 1
+        elif token not in AND_OPS | OR_OPS | NOT_OPS:
+            if not positive_only or (negated_depth is None and prev not in NOT_OPS):
+                terms.append(token)
+        prev = token
+    return terms
+
 class Searcher:
+    def __init__(self, index_dir="."):
+        self.index_dir = index_dir
+        self._universe = None
+        self._universe_version = None
+        self.snippets = SnippetStore(index_dir)
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def universe(self):
+        # universe.bin подменяется при перестроении в режиме --tail:
+        # перечитываем, когда меняется файл, как и dictionary.bin
+        try:
+            st = os.stat(self._path("universe.bin"))
+            version = (st.st_ino, st.st_mtime_ns)
+        except OSError:
+            version = None
+        if self._universe is None or version != self._universe_version:
+            if version is not None:
+                with open(self._path("universe.bin"), "rb") as f:
+                    self._universe = RoaringBitmap.deserialize(f.read())
+            else:
+                self._universe = RoaringBitmap()
+            self._universe_version = version
+        return self._universe
+
     def _get_postings(self, word):
         word = word.lower().strip()
-        if not os.path.exists("dictionary.bin"): return []
+        if not os.path.exists(self._path("dictionary.bin")): return []
         
-        with open("dictionary.bin", "rb") as f:
+        with open(self._path("dictionary.bin"), "rb") as f:
             f.seek(0, 2)
             num_terms = f.tell() // DICT_STRUCT.size
             
@@ -20,46 +81,195 @@ class Searcher:
                 mid = (low + high) // 2
                 f.seek(mid * DICT_STRUCT.size)
                 data = f.read(DICT_STRUCT.size)
-                term_b, freq, offset = DICT_STRUCT.unpack(data)
+                term_b, freq, offset, size, kind = DICT_STRUCT.unpack(data)
                 
                 current_term = term_b.decode('utf-8', errors='ignore').strip('\x00')
                 
                 if current_term == word:
-                    with open("postings.bin", "rb") as pf:
+                    with open(self._path("postings.bin"), "rb") as pf:
                         pf.seek(offset)
-                        ids_data = pf.read(freq * 4)
-                        return list(struct.unpack(f"<{freq}I", ids_data))
+                        return decode_postings(kind, pf.read(size))
                 elif current_term < word:
                     low = mid + 1
                 else:
                     high = mid - 1
         return []
 
-    def get_doc_info(self, doc_id):
-        return {"url": f"https://news.drom.ru/{doc_id}.html", "title": f"Новость {doc_id}"}
+    def search(self, query):
+        tokens = TOKEN_RE.findall(query.lower())
+        if not tokens:
+            return []
+        self._tokens, self._pos = tokens, 0
+        postings, negated = self._parse_or()
+        if negated:
+            postings = p_andnot(self.universe(), postings)
+        return postings
+
+    def term_stats(self, query):
+        # Термы под NOT в оценке не участвуют
+        terms = set(query_terms(query, positive_only=True))
+        return len(self.universe()), {term: len(self._get_postings(term)) for term in terms}
+
+    def rank(self, query, k=50, stats=None):
+        # stats - (число документов, df термов); у шардов - общие по всем шардам,
+        # чтобы оценки с разных шардов были сравнимы
+        result = list(self.search(query))
+        n, dfs = stats if stats is not None else self.term_stats(query)
+        scores = dict.fromkeys(result, 0.0)
+        for term, df in dfs.items():
+            if df:
+                weight = math.log(1 + n / df)
+                for doc_id in p_and(result, self._get_postings(term)):
+                    scores[doc_id] += weight
+        return heapq.nlargest(k, ((score, doc_id) for doc_id, score in scores.items()),
+                              key=lambda x: (x[0], -x[1]))
+
+    def find(self, query, limit=50, ranked=False):
+        if ranked:
+            return [doc_id for _, doc_id in self.rank(query, limit)]
+        return first_ids(self.search(query), limit)
+
+    def _peek(self):
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else None
+
+    def _parse_or(self):
+        left, left_neg = self._parse_and()
+        while self._peek() in OR_OPS:
+            self._pos += 1
+            right, right_neg = self._parse_and()
+            if left_neg and right_neg:
+                left = p_and(left, right)
+            elif left_neg:
+                left, left_neg = p_andnot(self.universe(), p_andnot(left, right)), False
+            elif right_neg:
+                left = p_andnot(self.universe(), p_andnot(right, left))
+            else:
+                left = p_or(left, right)
+        return left, left_neg
+
+    def _parse_and(self):
+        left, left_neg = self._parse_not()
+        while self._peek() is not None and self._peek() not in OR_OPS and self._peek() != ")":
+            if self._peek() in AND_OPS:
+                self._pos += 1
+            right, right_neg = self._parse_not()
+            if left_neg and right_neg:
+                left = p_or(left, right)
+            elif left_neg:
+                left, left_neg = p_andnot(right, left), False
+            elif right_neg:
+                left = p_andnot(left, right)
+            else:
+                left = p_and(left, right)
+        return left, left_neg
+
+    def _parse_not(self):
+        token = self._peek()
+        if token is None:
+            return [], False
+        self._pos += 1
+        if token in NOT_OPS:
+            postings, negated = self._parse_not()
+            return postings, not negated
+        if token == "(":
+            result = self._parse_or()
+            if self._peek() == ")":
+                self._pos += 1
+            return result
+        return self._get_postings(token), False
+
+    def get_doc_info(self, doc_id, query=""):
+        return {
+            "url": f"https://news.drom.ru/{doc_id}.html",
+            "title": f"Новость {doc_id}",
+            "snippet": self.snippets.snippet(doc_id, query_terms(query, positive_only=True)),
+        }
+
+_shard_searchers = {}
+
+def _shard(index_dir):
+    if index_dir not in _shard_searchers:
+        _shard_searchers[index_dir] = Searcher(index_dir)
+    return _shard_searchers[index_dir]
+
+def _shard_stats(index_dir, query):
+    return _shard(index_dir).term_stats(query)
+
+def _shard_query(index_dir, query, limit, stats):
+    shard = _shard(index_dir)
+    if stats is not None:
+        return shard.rank(query, limit, stats)
+    return first_ids(shard.search(query), limit)
+
+class ShardedSearcher:
+    # Шарды разбиты по docid, поэтому результаты не пересекаются:
+    # булевы списки сливаются по docid, ранжированные - кучей top-k.
+    def __init__(self, index_dirs, workers=None):
+        self.index_dirs = list(index_dirs)
+        self.pool = ProcessPoolExecutor(max_workers=workers or len(self.index_dirs))
+        self.doc_shards = [Searcher(d) for d in self.index_dirs]
+
+    def _global_stats(self, query):
+        futures = [self.pool.submit(_shard_stats, d, query) for d in self.index_dirs]
+        n, dfs = 0, {}
+        for f in futures:
+            shard_n, shard_dfs = f.result()
+            n += shard_n
+            for term, df in shard_dfs.items():
+                dfs[term] = dfs.get(term, 0) + df
+        return n, dfs
+
+    def find(self, query, limit=50, ranked=False):
+        stats = self._global_stats(query) if ranked else None
+        futures = [self.pool.submit(_shard_query, d, query, limit, stats) for d in self.index_dirs]
+        parts = [f.result() for f in futures]
+        if ranked:
+            top = heapq.nlargest(limit, chain.from_iterable(parts), key=lambda x: (x[0], -x[1]))
+            return [doc_id for _, doc_id in top]
+        return list(islice(heapq.merge(*parts), limit))
+
+    def get_doc_info(self, doc_id, query=""):
+        return self.doc_shards[doc_id % len(self.doc_shards)].get_doc_info(doc_id, query)
+
+    def close(self):
+        self.pool.shutdown()
+
+def shard_dirs(root, num_shards):
+    return [os.path.join(root, f"shard_{i}") for i in range(num_shards)]
 
 searcher = Searcher()
 
 @app.route("/")
 def index():
     query = request.args.get("q", "")
+    ranked = request.args.get("rank") == "1"
     results = []
     if query:
-        ids = searcher._get_postings(query)
-        results = [searcher.get_doc_info(idx) for idx in ids[:50]]
+        ids = searcher.find(query, 50, ranked)
+        results = [searcher.get_doc_info(idx, query) for idx in ids]
     
     return render_template_string("""
         <form>
             <input name="q" value="{{q}}">
+            <label><input type="checkbox" name="rank" value="1" {% if ranked %}checked{% endif %}> по релевантности</label>
             <button>Поиск</button>
         </form>
         <ul>
         {% for res in results %}
-            <li><a href="{{res.url}}">{{res.title}}</a></li>
+            <li><a href="{{res.url}}">{{res.title}}</a><br>{{res.snippet|safe}}</li>
         {% endfor %}
         </ul>
-    """, q=query, results=results)
+    """, q=query, ranked=ranked, results=results)
 
 if __name__ == "__main__":
-    import os
+    parser = argparse.ArgumentParser(description="Булев поиск")
+    parser.add_argument("--index-dir", default=".")
+    parser.add_argument("--shards", type=int, default=1, help="Число шардов в index-dir/shard_N")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    if args.shards > 1:
+        searcher = ShardedSearcher(shard_dirs(args.index_dir, args.shards), args.workers)
+    else:
+        searcher = Searcher(args.index_dir)
     app.run(port=5000)
\ No newline at end of file
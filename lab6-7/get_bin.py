@@ -2,86 +2,225 @@ import os
 import json
 import struct
 import re
+import argparse
+import time
+from multiprocessing import Pool
 from pathlib import Path
 
-DICT_STRUCT = struct.Struct("<32sIQ") 
+from postings import RoaringBitmap, encode_postings
+from snippets import SnippetWriter
+
+DICT_STRUCT = struct.Struct("<32sIQIB")
 DOC_STRUCT = struct.Struct("<I128s124s")
 
-def build_index(corpus_dir):
+def read_corpus(corpus_dir, shard=0, num_shards=1):
     corpus_path = Path(corpus_dir)
     meta_file = corpus_path / "meta" / "metadata.jsonl"
     text_dir = corpus_path / "text"
-    
-    inverted_index = {} 
-    docs_for_forward = []
 
     print("Шаг 1: Чтение метаданных...")
     if not meta_file.exists():
         print(f"Ошибка: Файл {meta_file} не найден!")
         return
 
+    docs = []
     with open(meta_file, 'r', encoding='utf-8') as f:
         for line in f:
             try:
                 data = json.loads(line)
                 if str(data['id']).isdigit():
-                    docs_for_forward.append(data)
+                    docs.append(data)
                 else:
                     print(f"Пропуск некорректного ID: {data['id']}")
             except (json.JSONDecodeError, KeyError):
                 continue
 
-    print(f"Загружено метаданных для {len(docs_for_forward)} документов.")
+    print(f"Загружено метаданных для {len(docs)} документов.")
 
-    print("Шаг 2: Токенизация и сбор слов...")
-    indexed_count = 0
-    for doc in docs_for_forward:
+    for doc in docs:
         doc_id = int(doc['id'])
+        if doc_id % num_shards != shard:
+            continue
         txt_path = text_dir / f"{doc_id}.txt"
-        
         if txt_path.exists():
             with open(txt_path, 'r', encoding='utf-8') as f:
-                text = f.read().lower()
-                words = set(re.findall(r'[a-zа-я0-9]+', text))
-                for word in words:
-                    if len(word) > 31: word = word[:31]
-                    if word not in inverted_index:
-                        inverted_index[word] = []
-                    inverted_index[word].append(doc_id)
-            indexed_count += 1
-            if indexed_count % 1000 == 0:
-                print(f"Обработано {indexed_count} файлов...")
-
-    print(f"Шаг 3: Запись forward.bin (всего {len(docs_for_forward)} записей)...")
-    with open("forward.bin", "wb") as f:
-        for doc in docs_for_forward:
+                yield doc_id, doc['url'], f.read()
+
+def add_document(inverted_index, doc_id, text):
+    words = set(re.findall(r'[a-zа-я0-9]+', text.lower()))
+    for word in words:
+        if len(word) > 31: word = word[:31]
+        if word not in inverted_index:
+            inverted_index[word] = []
+        inverted_index[word].append(doc_id)
+
+def remove_document(inverted_index, doc_id, text):
+    words = set(re.findall(r'[a-zа-я0-9]+', text.lower()))
+    for word in words:
+        word = word[:31]
+        postings = inverted_index.get(word)
+        if not postings:
+            continue
+        try:
+            postings.remove(doc_id)
+        except ValueError:
+            continue
+        if not postings:
+            del inverted_index[word]
+
+def write_index(inverted_index, docs_for_forward, out_dir="."):
+    # Файлы пишутся во временные и подменяются целиком, чтобы поисковик
+    # не увидел наполовину записанный индекс при перестроении в режиме --tail.
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    print(f"Шаг 3: Запись {out / 'forward.bin'} (всего {len(docs_for_forward)} записей)...")
+    with open(out / "forward.bin.tmp", "wb") as f:
+        for doc_id, url in sorted(docs_for_forward.items()):
             try:
-                doc_id = int(doc['id'])
-                url = doc['url'].encode('utf-8')[:127]
+                url = url.encode('utf-8')[:127]
                 title = f"Drom Article {doc_id}".encode('utf-8')[:123]
                 f.write(DOC_STRUCT.pack(doc_id, url, title))
             except Exception as e:
-                print(f"Ошибка записи документа {doc.get('id')}: {e}")
+                print(f"Ошибка записи документа {doc_id}: {e}")
 
     print("Шаг 4: Запись dictionary.bin и postings.bin...")
-    with open("dictionary.bin", "wb") as f_dict, open("postings.bin", "wb") as f_post:
+    with open(out / "dictionary.bin.tmp", "wb") as f_dict, open(out / "postings.bin.tmp", "wb") as f_post:
         current_offset = 0
         sorted_terms = sorted(inverted_index.keys())
         print(f"Всего уникальных термов: {len(sorted_terms)}")
 
+        bitmap_terms = 0
         for term in sorted_terms:
-            postings = sorted(list(set(inverted_index[term]))) 
+            postings = sorted(list(set(inverted_index[term])))
             freq = len(postings)
-            
-            post_data = struct.pack(f"<{freq}I", *postings)
+
+            kind, post_data = encode_postings(postings, len(docs_for_forward))
             f_post.write(post_data)
-            
+            bitmap_terms += kind
+
             term_bytes = term.encode('utf-8').ljust(32, b'\x00')
-            f_dict.write(DICT_STRUCT.pack(term_bytes, freq, current_offset))
-            
-            current_offset += freq * 4
+            f_dict.write(DICT_STRUCT.pack(term_bytes, freq, current_offset, len(post_data), kind))
+
+            current_offset += len(post_data)
+        print(f"Термов в формате bitmap: {bitmap_terms}")
+
+    with open(out / "universe.bin.tmp", "wb") as f:
+        f.write(RoaringBitmap.from_sorted(sorted(docs_for_forward)).serialize())
+
+    for name in ("forward.bin", "postings.bin", "dictionary.bin", "universe.bin"):
+        os.replace(out / f"{name}.tmp", out / name)
+
+def build_from_docs(docs, out_dir="."):
+    inverted_index = {}
+    docs_for_forward = {}
+    snippets = SnippetWriter(out_dir)
+
+    print("Шаг 2: Токенизация и сбор слов...")
+    for doc_id, url, text in docs:
+        add_document(inverted_index, doc_id, text)
+        snippets.add(doc_id, text)
+        docs_for_forward[doc_id] = url
+        if len(docs_for_forward) % 1000 == 0:
+            print(f"Обработано {len(docs_for_forward)} документов...")
 
+    snippets.close()
+    write_index(inverted_index, docs_for_forward, out_dir)
+    return inverted_index, docs_for_forward
+
+def shard_dir(out_root, shard):
+    return Path(out_root) / f"shard_{shard}"
+
+def build_shard(corpus_dir, shard, num_shards, out_root):
+    _, docs = build_from_docs(read_corpus(corpus_dir, shard, num_shards), shard_dir(out_root, shard))
+    return len(docs)
+
+def build_sharded(corpus_dir, num_shards, out_root):
+    # Шарды по docid % num_shards строятся параллельно, по процессу на шард
+    with Pool(num_shards) as pool:
+        counts = pool.starmap(build_shard, [(corpus_dir, i, num_shards, out_root) for i in range(num_shards)])
+    print(f"Документов по шардам: {counts}")
+
+def build_index(corpus_dir, num_shards=1, out_root="."):
+    if num_shards == 1:
+        build_from_docs(read_corpus(corpus_dir), out_root)
+    else:
+        build_sharded(corpus_dir, num_shards, out_root)
     print("=== Успех! Индексация завершена ===")
 
+def index_mongo(args):
+    from mongo_source import MongoDocSource
+
+    source = MongoDocSource(args.mongo, args.db, batch_size=args.batch_size)
+    shards = [({}, {}) for _ in range(args.shards)]
+
+    def out_dir(shard):
+        return args.out if args.shards == 1 else shard_dir(args.out, shard)
+
+    snippets = [SnippetWriter(out_dir(shard)) for shard in range(args.shards)]
+
+    def add(doc_id, url, text, old_text=None):
+        shard = doc_id % args.shards
+        inverted_index, docs_for_forward = shards[shard]
+        if old_text is not None:
+            remove_document(inverted_index, doc_id, old_text)
+        add_document(inverted_index, doc_id, text)
+        snippets[shard].add(doc_id, text)
+        docs_for_forward[doc_id] = url
+        return shard
+
+    try:
+        print("Шаг 2: Токенизация и сбор слов...")
+        for doc in source.scan():
+            add(*doc)
+        for shard, (inverted_index, docs_for_forward) in enumerate(shards):
+            snippets[shard].flush()
+            write_index(inverted_index, docs_for_forward, out_dir(shard))
+        total = sum(len(docs) for _, docs in shards)
+        print(f"=== Проиндексировано {total} документов из Mongo ===")
+        if not args.tail:
+            return
+
+        # Каждый сброс полностью перестраивает файлы измененных шардов, поэтому
+        # в простое сбрасываем не чаще, чем раз в min_flush_interval секунд
+        pending = 0
+        dirty = set()
+        last_flush = time.monotonic()
+        for doc in source.tail(args.mode, args.poll_interval):
+            if doc is not None:
+                dirty.add(add(*doc))
+                pending += 1
+            idle_due = doc is None and time.monotonic() - last_flush >= args.min_flush_interval
+            if pending and (idle_due or pending >= args.flush_every):
+                for shard in sorted(dirty):
+                    snippets[shard].flush()
+                    write_index(*shards[shard], out_dir(shard))
+                total = sum(len(docs) for _, docs in shards)
+                print(f"Добавлено {pending} документов, всего {total}")
+                pending = 0
+                dirty.clear()
+                last_flush = time.monotonic()
+    finally:
+        for writer in snippets:
+            writer.close()
+
 if __name__ == "__main__":
-    build_index("drom_corpus")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Построение бинарного индекса")
+    parser.add_argument("--corpus", default="drom_corpus", help="Корпус lab1 (text/ и meta/)")
+    parser.add_argument("--mongo", help="URI Mongo краулера lab2: индексировать коллекцию docs")
+    parser.add_argument("--db", default="drom_search_db")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--tail", action="store_true",
+                        help="После полного прохода следить за новыми документами и периодически перестраивать индекс")
+    parser.add_argument("--mode", choices=["auto", "changestream", "poll"], default="auto")
+    parser.add_argument("--poll-interval", type=float, default=10.0)
+    parser.add_argument("--flush-every", type=int, default=500)
+    parser.add_argument("--min-flush-interval", type=float, default=60.0,
+                        help="Минимальный интервал перестроения индекса в простое, с")
+    parser.add_argument("--shards", type=int, default=1, help="Число шардов по docid (out/shard_N)")
+    parser.add_argument("--out", default=".", help="Каталог индекса")
+    args = parser.parse_args()
+
+    if args.mongo:
+        index_mongo(args)
+    else:
+        build_index(args.corpus, args.shards, args.out)
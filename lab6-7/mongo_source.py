@@ -0,0 +1,136 @@
+import re
+import time
+
+from bs4 import BeautifulSoup
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+DOC_ID_RE = re.compile(r'/(\d+)\.html$')
+PROJECTION = {'url': 1, 'raw_html': 1, 'crawl_ts': 1}
+
+def extract_text(html):
+    soup = BeautifulSoup(html, "lxml")
+    for tag in soup(["script", "style", "noscript", "header", "footer", "nav"]):
+        tag.decompose()
+
+    article_body = soup.find('div', {'class': 'b-article__content'}) or \
+                   soup.find('div', {'class': 'b-news-item__content'}) or \
+                   soup.find('div', {'id': 'tx'})
+
+    node = article_body if article_body else soup
+    return re.sub(r'\s+', ' ', node.get_text(separator=" ", strip=True))
+
+
+class MongoDocSource:
+    def __init__(self, uri, database, batch_size=1000):
+        self.client = MongoClient(uri)
+        self.col_docs = self.client[database]['docs']
+        self.col_docs.create_index('crawl_ts')
+        self.col_docs.create_index([('url', ASCENDING), ('crawl_ts', DESCENDING)])
+        self.batch_size = batch_size
+        self.watermark = 0
+        self.boundary_ids = set()
+
+    def _to_doc(self, rec):
+        self._advance(rec)
+        match = DOC_ID_RE.search(rec.get('url', ''))
+        if not match or not rec.get('raw_html'):
+            return None
+        return int(match.group(1)), rec['url'], extract_text(rec['raw_html'])
+
+    def _previous_text(self, rec):
+        prev = self.col_docs.find_one(
+            {'url': rec['url'], '_id': {'$ne': rec['_id']}, 'crawl_ts': {'$lte': rec.get('crawl_ts', 0)}},
+            {'raw_html': 1}, sort=[('crawl_ts', DESCENDING)]
+        )
+        if prev is None or not prev.get('raw_html'):
+            return None
+        return extract_text(prev['raw_html'])
+
+    def _to_update(self, rec):
+        # Новая версия документа: вместе с текстом отдаем текст предыдущей
+        # версии, чтобы индексатор убрал ее термы
+        doc = self._to_doc(rec)
+        if doc is None:
+            return None
+        return (*doc, self._previous_text(rec))
+
+    def _advance(self, rec):
+        ts = rec.get('crawl_ts', 0)
+        if ts > self.watermark:
+            self.watermark = ts
+            self.boundary_ids = set()
+        if ts == self.watermark:
+            self.boundary_ids.add(rec['_id'])
+
+    def _read_since_watermark(self):
+        cursor = self.col_docs.find(
+            {'crawl_ts': {'$gte': self.watermark}}, PROJECTION,
+            batch_size=self.batch_size, no_cursor_timeout=True
+        ).sort('crawl_ts', ASCENDING)
+        with cursor:
+            for rec in cursor:
+                if rec.get('crawl_ts', 0) == self.watermark and rec['_id'] in self.boundary_ids:
+                    continue
+                doc = self._to_update(rec)
+                if doc is not None:
+                    yield doc
+
+    def scan(self):
+        # В docs по версии на каждое изменение страницы; индексируем только
+        # последнюю. Группировка идет без raw_html, тексты дочитываются по _id.
+        latest = self.col_docs.aggregate([
+            {'$sort': {'url': ASCENDING, 'crawl_ts': DESCENDING}},
+            {'$group': {'_id': '$url', 'doc': {'$first': '$_id'}}},
+        ], allowDiskUse=True, batchSize=self.batch_size)
+        with latest:
+            batch = []
+            for group in latest:
+                batch.append(group['doc'])
+                if len(batch) >= self.batch_size:
+                    yield from self._read_ids(batch)
+                    batch = []
+            yield from self._read_ids(batch)
+
+    def _read_ids(self, ids):
+        if not ids:
+            return
+        for rec in self.col_docs.find({'_id': {'$in': ids}}, PROJECTION):
+            doc = self._to_doc(rec)
+            if doc is not None:
+                yield doc
+
+    def poll(self, interval):
+        while True:
+            yield from self._read_since_watermark()
+            yield None
+            time.sleep(interval)
+
+    def watch(self, await_ms=1000):
+        pipeline = [
+            {'$match': {'operationType': 'insert'}},
+            {'$project': {f'fullDocument.{k}': 1 for k in ('_id', *PROJECTION)}},
+        ]
+        with self.col_docs.watch(pipeline, max_await_time_ms=await_ms) as stream:
+            # Документы, вставленные между полным проходом и открытием
+            # потока изменений, добираем по водяной отметке crawl_ts.
+            yield from self._read_since_watermark()
+            while stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    yield None
+                    continue
+                doc = self._to_update(change['fullDocument'])
+                if doc is not None:
+                    yield doc
+
+    def tail(self, mode="auto", poll_interval=10.0):
+        if mode in ("auto", "changestream"):
+            try:
+                yield from self.watch()
+                return
+            except OperationFailure as e:
+                if mode == "changestream":
+                    raise
+                print(f"Change stream недоступен ({e.code}), переход на опрос по crawl_ts")
+        yield from self.poll(poll_interval)
@@ -0,0 +1,311 @@
+import struct
+from itertools import islice
+
+KIND_ARRAY = 0
+KIND_ROARING = 1
+
+# Термы, встречающиеся хотя бы в такой доле документов, хранятся как битмапы
+HYBRID_DF_RATIO = 0.01
+
+CONTAINER_ARRAY = 0
+CONTAINER_BITMAP = 1
+CONTAINER_RUN = 2
+
+ARRAY_MAX_CARD = 4096
+BITMAP_BYTES = 8192
+
+HEADER_STRUCT = struct.Struct("<I")
+CONTAINER_STRUCT = struct.Struct("<HBI")
+
+_BYTE_BITS = [tuple(b for b in range(8) if byte >> b & 1) for byte in range(256)]
+
+
+def _bits_to_array(bits):
+    out = []
+    data = bits.to_bytes(BITMAP_BYTES, "little")
+    for i, byte in enumerate(data):
+        if byte:
+            base = i << 3
+            out.extend(base + b for b in _BYTE_BITS[byte])
+    return out
+
+
+def _array_to_bits(values):
+    # bits |= 1 << v создавал бы новый int на 8 КБ на каждое значение
+    data = bytearray(BITMAP_BYTES)
+    for v in values:
+        data[v >> 3] |= 1 << (v & 7)
+    return int.from_bytes(data, "little")
+
+
+def _runs(values):
+    runs = []
+    start = prev = values[0]
+    for v in values[1:]:
+        if v != prev + 1:
+            runs.append((start, prev - start))
+            start = v
+        prev = v
+    runs.append((start, prev - start))
+    return runs
+
+
+def _normalize(container):
+    # Битмап-контейнеры хранятся как int на 65536 бит: &, |, & ~ выполняются
+    # в CPython пословно, по 30-битным «цифрам» за раз.
+    if isinstance(container, int):
+        if container.bit_count() <= ARRAY_MAX_CARD:
+            return _bits_to_array(container)
+        return container
+    if len(container) > ARRAY_MAX_CARD:
+        return _array_to_bits(container)
+    return container
+
+
+def _container_and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return _normalize(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        # Проверка бита через bytes: b >> v создавал бы новый int на 8 КБ
+        data = b.to_bytes(BITMAP_BYTES, "little")
+        return [v for v in a if data[v >> 3] >> (v & 7) & 1]
+    return intersect_sorted(a, b)
+
+
+def _container_or(a, b):
+    if isinstance(a, int) or isinstance(b, int):
+        if not isinstance(a, int):
+            a = _array_to_bits(a)
+        if not isinstance(b, int):
+            b = _array_to_bits(b)
+        return _normalize(a | b)
+    return _normalize(union_sorted(a, b))
+
+
+def _container_andnot(a, b):
+    if isinstance(a, int):
+        if not isinstance(b, int):
+            b = _array_to_bits(b)
+        return _normalize(a & ~b)
+    if isinstance(b, int):
+        data = b.to_bytes(BITMAP_BYTES, "little")
+        return [v for v in a if not data[v >> 3] >> (v & 7) & 1]
+    return difference_sorted(a, b)
+
+
+class RoaringBitmap:
+    def __init__(self, containers=None):
+        self.containers = containers if containers is not None else {}
+        self._probes = {}
+
+    @classmethod
+    def from_sorted(cls, doc_ids):
+        containers = {}
+        chunk = []
+        key = None
+        for doc_id in doc_ids:
+            hi = doc_id >> 16
+            if hi != key:
+                if chunk:
+                    containers[key] = _normalize(chunk)
+                key, chunk = hi, []
+            chunk.append(doc_id & 0xFFFF)
+        if chunk:
+            containers[key] = _normalize(chunk)
+        return cls(containers)
+
+    def __len__(self):
+        return sum(c.bit_count() if isinstance(c, int) else len(c)
+                   for c in self.containers.values())
+
+    def _probe(self, key):
+        # Контейнер в виде для точечных проверок: bytes для битмапа,
+        # frozenset для массива. Битмап неизменяем, поэтому кэшируется.
+        probe = self._probes.get(key)
+        if probe is None:
+            c = self.containers.get(key)
+            if c is None:
+                probe = frozenset()
+            elif isinstance(c, int):
+                probe = c.to_bytes(BITMAP_BYTES, "little")
+            else:
+                probe = frozenset(c)
+            self._probes[key] = probe
+        return probe
+
+    def __contains__(self, doc_id):
+        probe = self._probe(doc_id >> 16)
+        low = doc_id & 0xFFFF
+        if isinstance(probe, bytes):
+            return bool(probe[low >> 3] >> (low & 7) & 1)
+        return low in probe
+
+    def select(self, doc_ids, keep=True):
+        out = []
+        key, probe, is_bits = None, None, False
+        for doc_id in doc_ids:
+            hi = doc_id >> 16
+            if hi != key:
+                key, probe = hi, self._probe(hi)
+                is_bits = isinstance(probe, bytes)
+            low = doc_id & 0xFFFF
+            found = bool(probe[low >> 3] >> (low & 7) & 1) if is_bits else low in probe
+            if found == keep:
+                out.append(doc_id)
+        return out
+
+    def __iter__(self):
+        for key in sorted(self.containers):
+            c = self.containers[key]
+            base = key << 16
+            values = _bits_to_array(c) if isinstance(c, int) else c
+            for v in values:
+                yield base | v
+
+    def _combine(self, other, op, keep_left, keep_right):
+        out = {}
+        for key in self.containers.keys() | other.containers.keys():
+            a = self.containers.get(key)
+            b = other.containers.get(key)
+            if a is None:
+                c = b if keep_right else None
+            elif b is None:
+                c = a if keep_left else None
+            else:
+                c = op(a, b)
+            if c:
+                out[key] = c
+        return RoaringBitmap(out)
+
+    def __and__(self, other):
+        return self._combine(other, _container_and, False, False)
+
+    def __or__(self, other):
+        return self._combine(other, _container_or, True, True)
+
+    def __sub__(self, other):
+        return self._combine(other, _container_andnot, True, False)
+
+    def serialize(self):
+        parts = [HEADER_STRUCT.pack(len(self.containers))]
+        for key in sorted(self.containers):
+            c = self.containers[key]
+            values = _bits_to_array(c) if isinstance(c, int) else c
+            runs = _runs(values)
+            sizes = {
+                CONTAINER_ARRAY: 2 * len(values),
+                CONTAINER_BITMAP: BITMAP_BYTES,
+                CONTAINER_RUN: 4 * len(runs),
+            }
+            kind = min(sizes, key=sizes.get)
+            if kind == CONTAINER_ARRAY:
+                parts.append(CONTAINER_STRUCT.pack(key, kind, len(values)))
+                parts.append(struct.pack(f"<{len(values)}H", *values))
+            elif kind == CONTAINER_BITMAP:
+                bits = c if isinstance(c, int) else _array_to_bits(c)
+                parts.append(CONTAINER_STRUCT.pack(key, kind, len(values)))
+                parts.append(bits.to_bytes(BITMAP_BYTES, "little"))
+            else:
+                flat = [x for run in runs for x in run]
+                parts.append(CONTAINER_STRUCT.pack(key, kind, len(runs)))
+                parts.append(struct.pack(f"<{len(flat)}H", *flat))
+        return b"".join(parts)
+
+    @classmethod
+    def deserialize(cls, data):
+        (count,) = HEADER_STRUCT.unpack_from(data, 0)
+        pos = HEADER_STRUCT.size
+        containers = {}
+        for _ in range(count):
+            key, kind, n = CONTAINER_STRUCT.unpack_from(data, pos)
+            pos += CONTAINER_STRUCT.size
+            if kind == CONTAINER_ARRAY:
+                containers[key] = list(struct.unpack_from(f"<{n}H", data, pos))
+                pos += 2 * n
+            elif kind == CONTAINER_BITMAP:
+                containers[key] = _normalize(int.from_bytes(data[pos:pos + BITMAP_BYTES], "little"))
+                pos += BITMAP_BYTES
+            else:
+                flat = struct.unpack_from(f"<{2 * n}H", data, pos)
+                bits = 0
+                for start, length in zip(flat[::2], flat[1::2]):
+                    bits |= ((1 << (length + 1)) - 1) << start
+                containers[key] = _normalize(bits)
+                pos += 4 * n
+        return cls(containers)
+
+
+def intersect_sorted(a, b):
+    out = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] == b[j]:
+            out.append(a[i])
+            i += 1
+            j += 1
+        elif a[i] < b[j]:
+            i += 1
+        else:
+            j += 1
+    return out
+
+
+def union_sorted(a, b):
+    return sorted(set(a).union(b))
+
+
+def difference_sorted(a, b):
+    exclude = set(b)
+    return [v for v in a if v not in exclude]
+
+
+def encode_postings(postings, num_docs):
+    array_data = struct.pack(f"<{len(postings)}I", *postings)
+    if len(postings) < num_docs * HYBRID_DF_RATIO:
+        return KIND_ARRAY, array_data
+    roaring_data = RoaringBitmap.from_sorted(postings).serialize()
+    if len(roaring_data) < len(array_data):
+        return KIND_ROARING, roaring_data
+    return KIND_ARRAY, array_data
+
+
+def decode_postings(kind, data):
+    if kind == KIND_ROARING:
+        return RoaringBitmap.deserialize(data)
+    return list(struct.unpack(f"<{len(data) // 4}I", data))
+
+
+def p_and(a, b):
+    if isinstance(a, RoaringBitmap) and isinstance(b, RoaringBitmap):
+        return a & b
+    if isinstance(a, RoaringBitmap):
+        a, b = b, a
+    if isinstance(b, RoaringBitmap):
+        return b.select(a)
+    return intersect_sorted(a, b)
+
+
+def p_or(a, b):
+    if isinstance(a, RoaringBitmap) or isinstance(b, RoaringBitmap):
+        if not isinstance(a, RoaringBitmap):
+            a = RoaringBitmap.from_sorted(a)
+        if not isinstance(b, RoaringBitmap):
+            b = RoaringBitmap.from_sorted(b)
+        return a | b
+    return union_sorted(a, b)
+
+
+def p_andnot(a, b):
+    if isinstance(a, RoaringBitmap):
+        if not isinstance(b, RoaringBitmap):
+            b = RoaringBitmap.from_sorted(b)
+        return a - b
+    if isinstance(b, RoaringBitmap):
+        return b.select(a, keep=False)
+    return difference_sorted(a, b)
+
+
+def first_ids(postings, limit):
+    return list(islice(iter(postings), limit))
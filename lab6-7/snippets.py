@@ -0,0 +1,137 @@
+import os
+import re
+import html
+import struct
+import zlib
+from functools import lru_cache
+
+# doc_id, смещение блока в snippets.bin, длина сжатого блока
+SNIPPET_IDX_STRUCT = struct.Struct("<IQI")
+MAX_STORED_CHARS = 5000
+WORD_RE = re.compile(r'[a-zа-я0-9]+', re.IGNORECASE)
+
+class SnippetWriter:
+    # Тексты пишутся в snippets.bin.tmp, первый flush() подменяет им snippets.bin
+    # вместе с snippets.idx. Дальше файл остается открытым: в режиме --tail новые
+    # версии документов дописываются в конец, старые смещения не меняются,
+    # а каждый flush() подменяет snippets.idx.
+    def __init__(self, out_dir):
+        self.data_path = os.path.join(out_dir, "snippets.bin")
+        self.idx_path = os.path.join(out_dir, "snippets.idx")
+        self.entries = {}
+        os.makedirs(out_dir, exist_ok=True)
+        self.f = open(self.data_path + ".tmp", "wb")
+        self.published = False
+
+    def add(self, doc_id, text):
+        block = zlib.compress(text[:MAX_STORED_CHARS].encode('utf-8'))
+        offset = self.f.tell()
+        self.f.write(block)
+        self.entries[doc_id] = (offset, len(block))
+
+    def flush(self):
+        self.f.flush()
+        with open(self.idx_path + ".tmp", "wb") as f:
+            for doc_id in sorted(self.entries):
+                f.write(SNIPPET_IDX_STRUCT.pack(doc_id, *self.entries[doc_id]))
+        if not self.published:
+            os.replace(self.data_path + ".tmp", self.data_path)
+            self.published = True
+        os.replace(self.idx_path + ".tmp", self.idx_path)
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+class SnippetStore:
+    def __init__(self, index_dir=".", cache_size=256):
+        self.data_path = os.path.join(index_dir, "snippets.bin")
+        self.idx_path = os.path.join(index_dir, "snippets.idx")
+        self._cached_text = lru_cache(maxsize=cache_size)(self._load_text)
+        self._idx_version = None
+
+    def text(self, doc_id):
+        # snippets.idx подменяется при перестроении индекса: кэш сбрасывается,
+        # когда меняется файл
+        try:
+            st = os.stat(self.idx_path)
+            version = (st.st_ino, st.st_mtime_ns)
+        except OSError:
+            version = None
+        if version != self._idx_version:
+            self._cached_text.cache_clear()
+            self._idx_version = version
+        return self._cached_text(doc_id)
+
+    def _find_block(self, doc_id):
+        if not os.path.exists(self.idx_path):
+            return None
+        with open(self.idx_path, "rb") as f:
+            f.seek(0, 2)
+            low, high = 0, f.tell() // SNIPPET_IDX_STRUCT.size - 1
+            while low <= high:
+                mid = (low + high) // 2
+                f.seek(mid * SNIPPET_IDX_STRUCT.size)
+                cur_id, offset, size = SNIPPET_IDX_STRUCT.unpack(f.read(SNIPPET_IDX_STRUCT.size))
+                if cur_id == doc_id:
+                    return offset, size
+                elif cur_id < doc_id:
+                    low = mid + 1
+                else:
+                    high = mid - 1
+        return None
+
+    def _load_text(self, doc_id):
+        block = self._find_block(doc_id)
+        if block is None:
+            return ""
+        offset, size = block
+        try:
+            with open(self.data_path, "rb") as f:
+                f.seek(offset)
+                return zlib.decompress(f.read(size)).decode('utf-8')
+        except (OSError, zlib.error):
+            return ""
+
+    def snippet(self, doc_id, terms, window=30):
+        text = self.text(doc_id)
+        if not text:
+            return ""
+        tokens = list(WORD_RE.finditer(text))
+        if not tokens:
+            return html.escape(text[:200])
+
+        terms = {t[:31] for t in terms}
+        hits = [(i, m.group().lower()[:31]) for i, m in enumerate(tokens) if m.group().lower()[:31] in terms]
+
+        # Окно из window токенов с наибольшим числом разных термов запроса,
+        # при равенстве - с наибольшим числом вхождений
+        best_start, best_score = 0, (0, 0)
+        counts = {}
+        left = 0
+        for right, (pos, term) in enumerate(hits):
+            counts[term] = counts.get(term, 0) + 1
+            while pos - hits[left][0] >= window:
+                old = hits[left][1]
+                counts[old] -= 1
+                if not counts[old]:
+                    del counts[old]
+                left += 1
+            score = (len(counts), right - left + 1)
+            if score > best_score:
+                best_score, best_start = score, hits[left][0]
+
+        start = max(0, min(best_start - window // 5, len(tokens) - window))
+        end = min(len(tokens), start + window)
+
+        parts = ["…"] if start > 0 else []
+        cursor = tokens[start].start()
+        for m in tokens[start:end]:
+            parts.append(html.escape(text[cursor:m.start()]))
+            word = html.escape(m.group())
+            parts.append(f"<b>{word}</b>" if m.group().lower()[:31] in terms else word)
+            cursor = m.end()
+        if end < len(tokens):
+            parts.append(" …")
+        return "".join(parts)